@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
-import os, sys, textwrap
+import os, sys
+from operator import attrgetter
 from datetime import datetime, timedelta, timezone
 from typing import List
 
+from digest_common import Paper, getenv_bool, getenv_list, print_digest, shorten
+
 try:
     import arxiv  # pip install arxiv
 except ImportError:
     print("Missing dependency 'arxiv'. Run: pip install arxiv", file=sys.stderr)
     sys.exit(1)
 
-def getenv_list(name: str, default: List[str]) -> List[str]:
-    raw = os.getenv(name, "")
-    return [s.strip() for s in raw.split(",") if s.strip()] if raw.strip() else default
+# Fields read off each arxiv.Result, fetched in one call per result
+_RESULT_FIELDS = attrgetter(
+    "title", "summary", "primary_category", "categories", "pdf_url", "entry_id", "published"
+)
 
 def build_query(categories: List[str], keywords: List[str], intersect: bool=False) -> str:
     # (cat:cs.LG OR cat:stat.ML ...) AND ((ti:"..." OR abs:"...") OR ...)
@@ -39,14 +43,19 @@ def main():
     keywords = [k.strip() for k in getenv_list("ARXIV_KEYWORDS", default_keywords)]
     days = int(os.getenv("ARXIV_DAYS", "3"))
     max_results = int(os.getenv("MAX_RESULTS", "500"))
-    include_abstracts = os.getenv("INCLUDE_ABSTRACTS", "false").lower() == "true"
-    intersect_keywords = os.getenv("INTERSECT_KW", "false").lower() == "true"
+    include_abstracts = getenv_bool("INCLUDE_ABSTRACTS")
+    intersect_keywords = getenv_bool("INTERSECT_KW")
 
     # polite client config
     delay = float(os.getenv("ARXIV_DELAY", "3.2"))      # seconds between requests
     page_size = int(os.getenv("ARXIV_PAGE_SIZE", "100"))
     retries = int(os.getenv("ARXIV_RETRIES", "4"))
 
+    # The API serves at most 2000 results per call and rejects totals above 30000;
+    # let the client page through slices instead of issuing oversized requests.
+    page_size = max(1, min(page_size, 2000))
+    max_results = max(1, min(max_results, 30000))
+
     since = datetime.now(timezone.utc) - timedelta(days=days)
 
     query = build_query(categories, [k.lower() for k in keywords], intersect_keywords)
@@ -69,26 +78,29 @@ def main():
 
     matches = []
     for result in client.results(search):
-        if result.published and result.published < since:
-            continue
+        title, summary, primary_cat, cats, pdf_url, entry_id, published = _RESULT_FIELDS(result)
 
-        title = (result.title or "").strip()
-        summary = (result.summary or "")
-        primary_cat = result.primary_category or (result.categories[0] if result.categories else "N/A")
-        pdf_url = result.pdf_url or result.entry_id
+        # Results come newest-first, so the first one outside the window ends the
+        # scan and no further pages are requested.
+        if published and published < since:
+            break
+
+        title = (title or "").strip()
+        summary = (summary or "")
+        primary_cat = primary_cat or (cats[0] if cats else "N/A")
+        pdf_url = pdf_url or entry_id
 
         snippet = ""
         if include_abstracts and summary:
-            s = " ".join(summary.split())
-            snippet = f"\n  – {textwrap.shorten(s, width=180, placeholder='…')}"
+            snippet = f"\n  – {shorten(summary, 180)}"
 
-        matches.append({
-            "title": title,
-            "url": pdf_url,
-            "date": result.published.strftime("%Y-%m-%d") if result.published else "N/A",
-            "cat": primary_cat,
-            "snippet": snippet
-        })
+        matches.append(Paper(
+            title=title,
+            url=pdf_url,
+            date=published.strftime("%Y-%m-%d") if published else "N/A",
+            cat=primary_cat,
+            snippet=snippet,
+        ))
 
     header = [
         f"arXiv weekly digest – last {days} day(s)",
@@ -97,16 +109,7 @@ def main():
         "",
     ]
 
-    if not matches:
-        print("\n".join(header + [f"No matching papers found these last {days} days."]))
-        return
-
-    lines = header + [f"Found {len(matches)} paper(s):", ""]
-    for i, m in enumerate(matches, start=1):
-        lines.append(f"{i}. {m['title']}  [{m['cat']}]  ({m['date']})")
-        lines.append(f"   {m['url']}{m['snippet']}")
-        lines.append("")
-    print("\n".join(lines))
+    print_digest(header, matches, days)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,45 @@
+# digest_common.py
+# Helpers shared by arxiv_weekly.py and semanticscholar_digest.py (stdlib only).
+import os, sys
+from collections import namedtuple
+from typing import List
+
+# One digest line; a namedtuple keeps thousands of results lighter than dicts
+Paper = namedtuple("Paper", "title url date cat snippet")
+
+
+def getenv_list(name: str, default: List[str]) -> List[str]:
+    raw = os.getenv(name, "")
+    return [s.strip() for s in raw.split(",") if s.strip()] if raw.strip() else default
+
+def getenv_bool(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).lower() == "true"
+
+def shorten(text: str, width: int, placeholder: str = "…") -> str:
+    # Collapse whitespace and cut at the last word boundary that fits, like textwrap.shorten.
+    # Only the head of the text can reach the output, so normalize a growing window of it
+    # rather than the whole abstract.
+    n = 2 * width + 1
+    while True:
+        s = " ".join(text[:n].split())
+        if len(s) > width or n >= len(text):
+            break
+        n *= 2
+    if len(s) <= width:
+        return s
+    cut = s.rfind(" ", 0, width - len(placeholder) + 1)
+    return (s[:cut] if cut > 0 else "") + placeholder
+
+def print_digest(header: List[str], matches: List[Paper], days: int) -> None:
+    # Write entry by entry rather than joining the whole digest into one string
+    write = sys.stdout.write
+    for line in header:
+        write(f"{line}\n")
+    if not matches:
+        write(f"No matching papers found these last {days} days.\n")
+        return
+
+    write(f"Found {len(matches)} paper(s):\n\n")
+    for i, m in enumerate(matches, start=1):
+        write(f"{i}. {m.title}  [{m.cat}]  ({m.date})\n")
+        write(f"   {m.url}{m.snippet}\n\n")
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 # semanticscholar_digest.py
-import os, sys, time, textwrap, random
+import os, re, sys, time, json, random, hashlib
 from datetime import datetime, timedelta, timezone
-from typing import List, Optional
+from typing import Callable, List, Optional
+from urllib.parse import urlencode
+
+from digest_common import Paper, getenv_bool, getenv_list, print_digest, shorten
 
 try:
     import requests  # pip install requests
@@ -10,47 +13,99 @@ except ImportError:
     print("Missing dependency 'requests'. Run: pip install requests", file=sys.stderr)
     sys.exit(1)
 
+try:
+    import orjson  # optional: faster decoding of large bulk pages
+except ImportError:
+    orjson = None
 
-# ---------------------------- helpers ----------------------------
+# Shared session so paginated requests reuse one keep-alive TLS connection
+SESSION = requests.Session()
+SESSION.headers.update({"Accept": "application/json"})
+
+# Response cache for repeat runs; entries older than S2_CACHE_TTL seconds are refetched
+CACHE_DIR = os.getenv("S2_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "s2_digest"))
 
-def getenv_list(name: str, default: List[str]) -> List[str]:
-    raw = os.getenv(name, "")
-    return [s.strip() for s in raw.split(",") if s.strip()] if raw.strip() else default
+
+# ---------------------------- helpers ----------------------------
 
 def normalize_kw_list(keywords: List[str]) -> List[str]:
     return [k.strip().lower() for k in keywords if k.strip()]
 
-def text_has_keywords(text: str, keywords: List[str], intersect: bool) -> bool:
-    t = (text or "").lower()
+def compile_keyword_matcher(keywords: List[str], intersect: bool) -> Callable[[str], bool]:
+    # One alternation regex scans the text once for any keyword; AND needs one pattern each.
     if not keywords:
-        return True
-    return all(kw in t for kw in keywords) if intersect else any(kw in t for kw in keywords)
-
-def build_free_text_query(keywords: List[str], fields_of_study: List[str]) -> str:
-    # Quote multi-word phrases; join with OR for recall. FOS tokens nudge relevance.
-    parts = [(f'"{kw}"' if " " in kw else kw) for kw in keywords]
-    if fields_of_study:
-        parts += fields_of_study
-    return " OR ".join(parts) if parts else "machine learning"
-
-def _parse_pubdate_utc(s: str) -> Optional[datetime]:
-    # Accept "YYYY-MM-DD" or ISO with/without 'Z'
+        return lambda text: True
+    if intersect:
+        # Longer phrases are rarer, so trying them first makes all() fail fast on misses
+        pats = [re.compile(re.escape(kw), re.IGNORECASE) for kw in sorted(keywords, key=len, reverse=True)]
+        return lambda text: all(p.search(text) for p in pats)
+    pat = re.compile("|".join(re.escape(kw) for kw in keywords), re.IGNORECASE)
+    return lambda text: pat.search(text) is not None
+
+def build_bulk_query(keywords: List[str], intersect: bool) -> str:
+    # Bulk search syntax: quoted phrases combined with "+" (AND) or "|" (OR)
+    parts = ['"' + kw.replace('"', "") + '"' for kw in keywords]
+    return (" + " if intersect else " | ").join(parts) if parts else "machine learning"
+
+class RateLimiter:
+    """Token bucket: at most `burst` back-to-back requests, refilled at `rate_per_sec`."""
+
+    def __init__(self, rate_per_sec: float, burst: int = 1):
+        self.rate = rate_per_sec
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.not_before = 0.0
+
+    def hold(self, seconds: float) -> None:
+        # Push the next acquire() back, e.g. until a server-advertised window resets
+        self.not_before = max(self.not_before, time.monotonic() + seconds)
+
+    def acquire(self) -> None:
+        now = time.monotonic()
+        if now < self.not_before:
+            time.sleep(self.not_before - now)
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens < 1:
+            time.sleep((1 - self.tokens) / self.rate)
+            self.tokens = 1.0
+            self.last_refill = time.monotonic()
+        self.tokens -= 1
+
+def _rate_limit_wait(resp, min_remaining: int = 2, max_sleep: float = 60.0) -> float:
+    """Seconds until the advertised window resets when few requests remain in it, else 0."""
+    remaining = resp.headers.get("x-ratelimit-remaining") or resp.headers.get("RateLimit-Remaining")
+    reset = resp.headers.get("x-ratelimit-reset") or resp.headers.get("RateLimit-Reset")
+    if not (remaining and reset):
+        return 0.0
     try:
-        s2 = s.replace("Z", "+00:00")
-        dt = datetime.fromisoformat(s2)
-    except Exception:
-        return None
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt
-
-def _request_with_backoff(url: str, headers: dict, params: dict, max_retries: int, base_sleep: float):
+        remaining_n, reset_s = int(remaining), float(reset)
+    except ValueError:
+        return 0.0
+    if remaining_n > min_remaining:
+        return 0.0
+    if reset_s > 1e9:
+        # Some servers send an epoch timestamp rather than seconds-until-reset
+        reset_s -= time.time()
+    return min(max(reset_s, 0.0), max_sleep)
+
+def _request_with_backoff(url: str, params: dict, max_retries: int, base_sleep: float,
+                          limiter: Optional[RateLimiter] = None):
     """GET with exponential backoff, honoring Retry-After on 429."""
     attempt = 0
     while True:
-        resp = requests.get(url, headers=headers, params=params, timeout=30)
+        if limiter:
+            limiter.acquire()
+        resp = SESSION.get(url, params=params, timeout=30)
         if resp.status_code != 429:
             resp.raise_for_status()
+            wait = _rate_limit_wait(resp)
+            if wait and limiter:
+                limiter.hold(wait)  # only delays a follow-up request, never the last one
+            elif wait:
+                time.sleep(wait)
             return resp
         attempt += 1
         if attempt > max_retries:
@@ -62,6 +117,34 @@ def _request_with_backoff(url: str, headers: dict, params: dict, max_retries: in
             sleep_s = base_sleep * (2 ** (attempt - 1)) + random.uniform(0, 0.5)
         time.sleep(sleep_s)
 
+def _decode_json(resp) -> dict:
+    return orjson.loads(resp.content) if orjson else resp.json()
+
+def _get_json_cached(url: str, params: dict, cache_ttl: float, **request_kwargs) -> dict:
+    """Return the decoded JSON for a GET, served from CACHE_DIR while younger than cache_ttl."""
+    if cache_ttl <= 0:
+        return _decode_json(_request_with_backoff(url, params, **request_kwargs))
+
+    key = hashlib.sha1(f"{url}?{urlencode(sorted(params.items()))}".encode()).hexdigest()
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        if time.time() - os.path.getmtime(path) < cache_ttl:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass  # missing, unreadable or corrupt entry: refetch
+
+    payload = _decode_json(_request_with_backoff(url, params, **request_kwargs))
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)  # atomic, so readers never see a partial entry
+    except OSError:
+        pass  # caching is best-effort
+    return payload
+
 
 # ---------------------------- core search ----------------------------
 
@@ -69,129 +152,119 @@ def fetch_semantic_scholar(
     keywords: List[str],
     since_dt: datetime,
     max_results: int,
-    page_size: int,
     delay: float,
     api_key: Optional[str],
     intersect: bool,
     fields_of_study: List[str],
+    include_abstracts: bool = False,
+    burst: int = 1,
     max_retries: int = 4,
     base_sleep: float = 1.5,
+    cache_ttl: float = 0.0,
 ):
-    base = "https://api.semanticscholar.org/graph/v1/paper/search"
-    headers = {"Accept": "application/json"}
+    # The bulk endpoint filters the date window server-side and pages with a cursor
+    # token (up to 1000 rows per call), instead of ranking all-time relevance hits.
+    base = "https://api.semanticscholar.org/graph/v1/paper/search/bulk"
     if api_key:
-        headers["x-api-key"] = api_key
+        SESSION.headers["x-api-key"] = api_key
 
-    query = build_free_text_query(keywords, fields_of_study)
+    query = build_bulk_query(keywords, intersect)
+    has_keywords = compile_keyword_matcher(keywords, intersect)
+    fos_filter = frozenset(f.lower() for f in fields_of_study)
     fields = "title,abstract,year,publicationDate,url,externalIds,fieldsOfStudy"
 
-    results = []
-    offset = 0
-    current_page_size = max(10, min(page_size, 100))
+    # ISO dates order lexicographically, so the window check needs no datetime parsing
+    since_str = since_dt.strftime("%Y-%m-%d")
 
-    # Guards to avoid deep offsets that can trigger 400s on some queries
-    hard_max_offset = int(os.getenv("S2_MAX_OFFSET", "400"))
-    # If we keep seeing old results, bail early
-    stale_rows_seen = 0
-    stale_rows_threshold = max(100, current_page_size * 3)
+    # Pace requests from their start times, so parsing a page counts toward the delay;
+    # `burst` lets the first few requests go out back-to-back at the same average rate
+    limiter = RateLimiter(1.0 / delay, burst=max(1, burst)) if delay > 0 else None
 
-    while len(results) < max_results:
-        if offset >= hard_max_offset:
-            # Stop before hitting problematic offsets
-            break
+    # Built once; only the cursor token changes between batches
+    params = {
+        "query": query,
+        "fields": fields,
+        "sort": "publicationDate:desc",
+        # Papers without a publication date are matched on their year
+        "publicationDateOrYear": f"{since_str}:",
+    }
 
-        limit = min(current_page_size, max_results - len(results))
-        params = {"query": query, "fields": fields, "limit": str(limit), "offset": str(offset)}
+    results = []
+    seen_ids = set()
 
+    while len(results) < max_results:
         try:
-            r = _request_with_backoff(base, headers, params, max_retries=max_retries, base_sleep=base_sleep)
-        except requests.HTTPError as e:
-            # If we hit 400 or 429 repeatedly, reduce page size and try next page; otherwise stop
-            status = e.response.status_code if e.response is not None else None
-            if status in (400, 429) and current_page_size > 10:
-                current_page_size = max(10, current_page_size // 2)
-                # skip ahead conservatively
-                offset += current_page_size
-                continue
-            # give up gracefully
+            payload = _get_json_cached(base, params, cache_ttl, max_retries=max_retries,
+                                       base_sleep=base_sleep, limiter=limiter)
+        except requests.HTTPError:
+            # give up gracefully, keeping what we already have
             break
 
-        payload = r.json()
-        data = payload.get("data", [])
-        total = payload.get("total")  # may be absent
-
-        if not data:
-            break
-
-        added_this_page = 0
+        data = payload.get("data") or []
         for p in data:
+            # Skip papers repeated across batches before doing any filtering work
+            ext = p.get("externalIds") or {}
+            pid = ext.get("DOI") or p.get("paperId") or p.get("url")
+            if pid:
+                if pid in seen_ids:
+                    continue
+                seen_ids.add(pid)
+
+            # The server already applied the window; re-check it cheaply alongside the
+            # field and keyword filters, which are stricter than S2's stemmed matching.
             pubdate = p.get("publicationDate")
             year = p.get("year")
 
             keep = False
             if pubdate:
-                dt = _parse_pubdate_utc(pubdate)
-                keep = (dt is not None) and (dt.date() >= since_dt.date())
+                keep = pubdate[:10] >= since_str
             elif year:
                 try:
                     keep = int(year) >= since_dt.year
                 except Exception:
                     keep = False
-            else:
-                keep = False
-
             if not keep:
-                stale_rows_seen += 1
+                continue
+
+            # Cheap field-of-study check first, so rejected papers skip the keyword scan
+            fos = p.get("fieldsOfStudy") or []
+            if fos_filter and fos_filter.isdisjoint(f.lower() for f in fos):
                 continue
 
             title = (p.get("title") or "").strip()
             abstract = p.get("abstract") or ""
-            if not (text_has_keywords(title, keywords, intersect) or
-                    text_has_keywords(abstract, keywords, intersect)):
+            # Match title and abstract in one scan; the newline keeps phrases from spanning both
+            if not has_keywords(title + "\n" + abstract):
                 continue
 
-            fos = p.get("fieldsOfStudy") or []
-            if fields_of_study:
-                lf = [f.lower() for f in fos]
-                if not any(fs.lower() in lf for fs in fields_of_study):
-                    continue
-
             url = p.get("url") or ""
-            ext = p.get("externalIds") or {}
             if not url and "ArXiv" in ext:
                 url = f"https://arxiv.org/abs/{ext['ArXiv']}"
 
             date_str = pubdate.split("T")[0] if pubdate else (str(year) if year else "N/A")
 
             snippet = ""
-            if os.getenv("INCLUDE_ABSTRACTS", "false").lower() == "true" and abstract:
-                s = " ".join(abstract.split())
-                snippet = f"\n  – {textwrap.shorten(s, width=180, placeholder='…')}"
-
-            results.append({
-                "title": title,
-                "url": url,
-                "date": date_str,
-                "cat": ", ".join(fos) if fos else "N/A",
-                "snippet": snippet,
-            })
-            added_this_page += 1
+            if include_abstracts and abstract:
+                snippet = f"\n  – {shorten(abstract, 180)}"
+
+            results.append(Paper(
+                title=title,
+                url=url,
+                date=date_str,
+                cat=", ".join(fos) if fos else "N/A",
+                snippet=snippet,
+            ))
             if len(results) >= max_results:
                 break
 
-        # Pagination bookkeeping
-        offset += len(data)
+        if len(results) >= max_results:
+            break  # enough papers; don't follow the cursor
 
-        # Stop early if API says we've reached the end
-        if total is not None and offset >= int(total):
+        # No continuation token means the last batch has been served
+        token = payload.get("token")
+        if not token:
             break
-
-        # If we’re only seeing stale/too-old rows for a while, stop digging
-        if stale_rows_seen >= stale_rows_threshold and len(results) == 0:
-            break
-
-        if delay:
-            time.sleep(delay)
+        params["token"] = token
 
     return results
 
@@ -203,17 +276,18 @@ def main():
     default_fos = []  # e.g., ["Computer Science", "Mathematics"]
 
     keywords = normalize_kw_list(getenv_list("S2_KEYWORDS", default_keywords))
-    intersect = os.getenv("S2_INTERSECT_KW", "false").lower() == "true"
+    intersect = getenv_bool("S2_INTERSECT_KW")
     days = int(os.getenv("S2_DAYS", "3"))
 
-    # Safer defaults to avoid 429/400
+    # Safer defaults to avoid 429s
     max_results = int(os.getenv("S2_MAX_RESULTS", "100"))
-    page_size = int(os.getenv("S2_PAGE_SIZE", "50"))
     delay = float(os.getenv("S2_DELAY", "1.5"))
+    burst = int(os.getenv("S2_BURST", "1"))
 
     fields_of_study = getenv_list("S2_FIELDS", default_fos)
-    include_abstracts = os.getenv("INCLUDE_ABSTRACTS", "false").lower() == "true"
+    include_abstracts = getenv_bool("INCLUDE_ABSTRACTS")
     api_key = os.getenv("S2_API_KEY", "").strip() or None
+    cache_ttl = float(os.getenv("S2_CACHE_TTL", "21600"))  # 6h; 0 disables the cache
 
     since = datetime.now(timezone.utc) - timedelta(days=days)
 
@@ -221,11 +295,13 @@ def main():
         keywords=keywords,
         since_dt=since,
         max_results=max_results,
-        page_size=page_size,
         delay=delay,
+        burst=burst,
         api_key=api_key,
         intersect=intersect,
         fields_of_study=fields_of_study,
+        include_abstracts=include_abstracts,
+        cache_ttl=cache_ttl,
     )
 
     header = [
@@ -236,16 +312,7 @@ def main():
         "",
     ]
 
-    if not matches:
-        print("\n".join(header + [f"No matching papers found these last {days} days."]))
-        return
-
-    lines = header + [f"Found {len(matches)} paper(s):", ""]
-    for i, m in enumerate(matches, start=1):
-        lines.append(f"{i}. {m['title']}  [{m['cat']}]  ({m['date']})")
-        lines.append(f"   {m['url']}{m['snippet']}")
-        lines.append("")
-    print("\n".join(lines))
+    print_digest(header, matches, days)
 
 
 if __name__ == "__main__":